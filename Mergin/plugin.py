@@ -3,10 +3,8 @@
 # GPLv3 license
 # Copyright Lutra Consulting Limited
 
-from math import floor
 import sip
 import os
-import shutil
 from pathlib import Path
 import posixpath
 from functools import partial
@@ -31,17 +29,11 @@ from qgis.utils import iface
 from qgis.PyQt.QtWidgets import QAction, QFileDialog, QMessageBox, QDockWidget
 from urllib.error import URLError
 
-from .configuration_dialog import ConfigurationDialog
-from .workspace_selection_dialog import WorkspaceSelectionDialog
-from .project_selection_dialog import ProjectSelectionDialog, PublicProjectSelectionDialog
-from .create_project_wizard import NewMerginProjectWizard
-from .clone_project_dialog import CloneProjectDialog
+# dialogs which are not needed at plugin start up (especially those compiling UI files when imported)
+# are imported only when used
 from .diff_dialog import DiffViewerDialog
 from .project_settings_widget import MerginProjectConfigFactory
 from .projects_manager import MerginProjectsManager
-from .sync_dialog import SyncDialog
-from .configure_sync_wizard import DbSyncConfigWizard
-from .remove_project_dialog import RemoveProjectDialog
 from .utils import (
     ServerType,
     ClientError,
@@ -55,7 +47,9 @@ from .utils import (
     is_number,
     login_error_message,
     mergin_project_local_path,
+    mergin_projects_local_paths,
     PROJS_PER_PAGE,
+    remove_local_project_dir,
     remove_project_variables,
     same_dir,
     unhandled_exception_message,
@@ -70,6 +64,18 @@ import processing
 MERGIN_CLIENT_LOG = os.path.join(QgsApplication.qgisSettingsDirPath(), "mergin-client-log.txt")
 os.environ["MERGIN_CLIENT_LOG"] = MERGIN_CLIENT_LOG
 
+# icons used by browser items and their actions, keyed by icon file path
+ICONS_CACHE = dict()
+
+
+def cached_icon(ipath):
+    """Get QIcon for the given icon file path, constructing it only on first use."""
+    icon = ICONS_CACHE.get(ipath)
+    if icon is None:
+        icon = QIcon(ipath)
+        ICONS_CACHE[ipath] = icon
+    return icon
+
 
 class MerginPlugin:
     def __init__(self, iface):
@@ -94,9 +100,10 @@ class MerginPlugin:
             self.iface.projectRead.connect(self.on_qgis_project_changed)
             self.iface.newProjectCreated.connect(self.on_qgis_project_changed)
 
-        settings = QSettings()
-        QgsExpressionContextUtils.setGlobalVariable("mergin_username", settings.value("Mergin/username", ""))
-        QgsExpressionContextUtils.setGlobalVariable("mergin_url", settings.value("Mergin/server", ""))
+        # settings instance reused by the plugin methods (all running in the main thread)
+        self.settings = QSettings()
+        QgsExpressionContextUtils.setGlobalVariable("mergin_username", self.settings.value("Mergin/username", ""))
+        QgsExpressionContextUtils.setGlobalVariable("mergin_url", self.settings.value("Mergin/server", ""))
 
     def initProcessing(self):
         QgsApplication.processingRegistry().addProvider(self.provider)
@@ -292,6 +299,8 @@ class MerginPlugin:
 
     def configure(self):
         """Open plugin configuration dialog."""
+        from .configuration_dialog import ConfigurationDialog
+
         dlg = ConfigurationDialog()
         if dlg.exec_():
             self.mc = dlg.writeSettings()
@@ -320,6 +329,8 @@ class MerginPlugin:
             )
             return
 
+        from .configure_sync_wizard import DbSyncConfigWizard
+
         wizard = DbSyncConfigWizard(project_name)
         if not wizard.exec_():
             return
@@ -342,10 +353,9 @@ class MerginPlugin:
 
         :param workspace: Dict containing workspace's "name" and "id" keys
         """
-        settings = QSettings()
         self.current_workspace = workspace
         workspace_id = self.current_workspace.get("id", None)
-        settings.setValue("Mergin/lastUsedWorkspaceId", workspace_id)
+        self.settings.setValue("Mergin/lastUsedWorkspaceId", workspace_id)
         if self.has_browser_item():
             self.data_item_provider.root_item.update_client_and_manager(mc=self.mc, manager=self.manager)
 
@@ -386,8 +396,7 @@ class MerginPlugin:
         if len(workspaces) == 1:
             workspace = workspaces[0]
         else:
-            settings = QSettings()
-            previous_workspace = settings.value("Mergin/lastUsedWorkspaceId", None, int)
+            previous_workspace = self.settings.value("Mergin/lastUsedWorkspaceId", None, int)
             workspace = None
             for ws in workspaces:
                 if previous_workspace == ws["id"]:
@@ -410,8 +419,6 @@ class MerginPlugin:
         if self.mc.server_type() != ServerType.OLD:
             return
 
-        settings = QSettings()
-
         # check action required flag
         service_response = self.mc.user_service()
 
@@ -448,6 +455,8 @@ class MerginPlugin:
         if self.mc.server_type() == ServerType.OLD:
             default_workspace = user_info["username"]
 
+        from .create_project_wizard import NewMerginProjectWizard
+
         wizard = NewMerginProjectWizard(self.manager, user_info=user_info, default_workspace=default_workspace)
         if not wizard.exec_():
             return  # cancelled
@@ -462,6 +471,8 @@ class MerginPlugin:
 
     def find_project(self):
         """Open new Find Mergin Maps project dialog"""
+        from .project_selection_dialog import ProjectSelectionDialog
+
         dlg = ProjectSelectionDialog(self.mc, self.current_workspace.get("name", None))
         dlg.new_project_clicked.connect(self.create_new_project)
         dlg.switch_workspace_clicked.connect(self.switch_workspace)
@@ -488,6 +499,8 @@ class MerginPlugin:
             self.current_workspace = dict()
             return
 
+        from .workspace_selection_dialog import WorkspaceSelectionDialog
+
         dlg = WorkspaceSelectionDialog(workspaces)
         dlg.manage_workspaces_clicked.connect(self.open_configured_url)
         if not dlg.exec_():
@@ -498,6 +511,8 @@ class MerginPlugin:
 
     def explore_public_projects(self):
         """Open new Explore public Mergin Maps projects dialog"""
+        from .project_selection_dialog import PublicProjectSelectionDialog
+
         dlg = PublicProjectSelectionDialog(self.mc)
         dlg.open_project_clicked.connect(self.manager.open_project)
         dlg.download_project_clicked.connect(self.manager.download_project)
@@ -619,7 +634,7 @@ class MerginRemoteProjectItem(QgsDataItem):
         QgsDataItem.__init__(self, QgsDataItem.Collection, parent, display_name, "/Mergin/" + self.project_name)
         self.path = None
         self.setSortKey(f"1 {self.name()}")
-        self.setIcon(QIcon(icon_path("cloud.svg")))
+        self.setIcon(cached_icon(icon_path("cloud.svg")))
         self.project_manager = project_manager
         if self.project_manager is not None:
             self.mc = self.project_manager.mc
@@ -634,6 +649,8 @@ class MerginRemoteProjectItem(QgsDataItem):
         self.project_manager.open_project(self.path)
 
     def clone_remote_project(self):
+        from .clone_project_dialog import CloneProjectDialog
+
         user_info = self.mc.user_info()
 
         dlg = CloneProjectDialog(user_info=user_info, default_workspace=self.project["namespace"])
@@ -657,6 +674,8 @@ class MerginRemoteProjectItem(QgsDataItem):
             group_items["My projects"].reload()
 
     def remove_remote_project(self):
+        from .remove_project_dialog import RemoveProjectDialog
+
         dlg = RemoveProjectDialog(self.project_name)
         if dlg.exec_() == QDialog.Rejected:
             return
@@ -673,17 +692,16 @@ class MerginRemoteProjectItem(QgsDataItem):
             login_error_message(e)
 
     def actions(self, parent):
-        action_download = QAction(QIcon(icon_path("cloud-download.svg")), "Download", parent)
+        action_download = QAction(cached_icon(icon_path("cloud-download.svg")), "Download", parent)
         action_download.triggered.connect(self.download)
 
-        action_clone_remote = QAction(QIcon(icon_path("copy.svg")), "Clone", parent)
+        action_clone_remote = QAction(cached_icon(icon_path("copy.svg")), "Clone", parent)
         action_clone_remote.triggered.connect(self.clone_remote_project)
 
-        action_remove_remote = QAction(QIcon(icon_path("trash.svg")), "Remove from server", parent)
-        action_remove_remote.triggered.connect(self.remove_remote_project)
-
         actions = [action_download, action_clone_remote]
         if self.project["permissions"]["delete"]:
+            action_remove_remote = QAction(cached_icon(icon_path("trash.svg")), "Remove from server", parent)
+            action_remove_remote.triggered.connect(self.remove_remote_project)
             actions.append(action_remove_remote)
         return actions
 
@@ -691,9 +709,10 @@ class MerginRemoteProjectItem(QgsDataItem):
 class MerginLocalProjectItem(QgsDirectoryItem):
     """Data item to represent a local Mergin Maps project."""
 
-    def __init__(self, parent, project, project_manager):
+    def __init__(self, parent, project, project_manager, path=None):
         self.project_name = posixpath.join(project["namespace"], project["name"])  # posix path for server API calls
-        self.path = mergin_project_local_path(self.project_name)
+        # local path is normally resolved by the parent item already, avoid reading settings once again
+        self.path = path if path is not None else mergin_project_local_path(self.project_name)
         display_name = project["name"]
         group_items = project_manager.get_mergin_browser_groups()
         if group_items.get("Shared with me") == parent:
@@ -766,7 +785,7 @@ class MerginLocalProjectItem(QgsDirectoryItem):
                 # as releasing lock on previously open files takes some time
                 # we have to wait a bit before removing them, otherwise rmtree
                 # will fail and removal of the local rpoject will fail as well
-                QTimer.singleShot(250, lambda: shutil.rmtree(self.path))
+                QTimer.singleShot(250, partial(remove_local_project_dir, self.path, self.project_name))
             except PermissionError as e:
                 QgsApplication.messageLog().logMessage(f"Mergin Maps plugin: {str(e)}")
                 msg = (
@@ -786,6 +805,8 @@ class MerginLocalProjectItem(QgsDirectoryItem):
         self.project_manager.submit_logs(self.path)
 
     def clone_remote_project(self):
+        from .clone_project_dialog import CloneProjectDialog
+
         user_info = self.mc.user_info()
 
         dlg = CloneProjectDialog(user_info=user_info, default_workspace=self.project["namespace"])
@@ -804,19 +825,19 @@ class MerginLocalProjectItem(QgsDirectoryItem):
             login_error_message(e)
 
     def actions(self, parent):
-        action_remove_local = QAction(QIcon(icon_path("trash.svg")), "Remove locally", parent)
+        action_remove_local = QAction(cached_icon(icon_path("trash.svg")), "Remove locally", parent)
         action_remove_local.triggered.connect(self.remove_local_project)
 
         action_open_project = QAction("Open QGIS project", parent)
         action_open_project.triggered.connect(self.open_project)
 
-        action_sync_project = QAction(QIcon(icon_path("refresh.svg")), "Synchronize", parent)
+        action_sync_project = QAction(cached_icon(icon_path("refresh.svg")), "Synchronize", parent)
         action_sync_project.triggered.connect(self.sync_project)
 
-        action_clone_remote = QAction(QIcon(icon_path("copy.svg")), "Clone", parent)
+        action_clone_remote = QAction(cached_icon(icon_path("copy.svg")), "Clone", parent)
         action_clone_remote.triggered.connect(self.clone_remote_project)
 
-        action_diagnostic_log = QAction(QIcon(icon_path("first-aid-kit.svg")), "Diagnostic log", parent)
+        action_diagnostic_log = QAction(cached_icon(icon_path("first-aid-kit.svg")), "Diagnostic log", parent)
         action_diagnostic_log.triggered.connect(self.submit_logs)
 
         actions = [
@@ -835,7 +856,7 @@ class FetchMoreItem(QgsDataItem):
     def __init__(self, parent):
         self.parent = parent
         QgsDataItem.__init__(self, QgsDataItem.Collection, parent, "Double-click for more...", "")
-        self.setIcon(QIcon(icon_path("dots.svg")))
+        self.setIcon(cached_icon(icon_path("dots.svg")))
         self.setSortKey("2")  # the item should appear at the bottom of the list
 
     def handleDoubleClick(self):
@@ -850,7 +871,7 @@ class ErrorItem(QgsErrorItem):
         QgsErrorItem.__init__(self, parent, error, path)
         self.parent = parent
         self.handler = double_click_handler
-        self.setIcon(QIcon(icon_path("alert-triangle.svg")))
+        self.setIcon(cached_icon(icon_path("alert-triangle.svg")))
 
     def handleDoubleClick(self):
         if self.handler:
@@ -866,7 +887,7 @@ class CreateNewProjectItem(QgsDataItem):
     def __init__(self, parent):
         self.parent = parent
         QgsDataItem.__init__(self, QgsDataItem.Collection, parent, "Create new project...", "")
-        self.setIcon(QIcon(icon_path("square-plus.svg")))
+        self.setIcon(cached_icon(icon_path("square-plus.svg")))
 
     def handleDoubleClick(self):
         self.parent.new_project()
@@ -890,7 +911,7 @@ class MerginRootItem(QgsDataCollectionItem):
         if name != providerKey:
             providerKey = "/Mergin" + name
         QgsDataCollectionItem.__init__(self, parent, name, providerKey)
-        self.setIcon(QIcon(mm_symbol_path()))
+        self.setIcon(cached_icon(mm_symbol_path()))
         self.setSortKey(order)
         self.plugin = plugin
         self.project_manager = plugin.manager
@@ -898,19 +919,24 @@ class MerginRootItem(QgsDataCollectionItem):
         self.error = ""
         self.wizard = None
         self.projects = []
+        # incremented whenever fetched projects are cleared, pages fetched meanwhile in populate worker are dropped
+        self.projects_generation = 0
+        self.refresh_pending = False
         self.total_projects_count = None
+        self.fetch_more_requested = False
         self.fetch_more_item = None
         self.create_new_project_item = None
         self.filter = flag
         self.base_name = self.name()
         self.updateName()
+        self.stateChanged.connect(self.on_state_changed)
 
     def update_client_and_manager(self, mc=None, manager=None, err=None):
         """Update Mergin client and project manager - used when starting or after a config change."""
         self.mc = mc
         self.project_manager = manager
         self.error = err
-        self.projects = []
+        self.reset_projects()
         self.updateName()
         self.depopulate()
 
@@ -931,7 +957,7 @@ class MerginRootItem(QgsDataCollectionItem):
                 handler = self.configure
                 self.error = "Double-click to configure…"
             error_item = ErrorItem(self, self.error, "Mergin/error", handler)
-            error_item.setIcon(QIcon(icon_path("alert-triangle.svg")))
+            error_item.setIcon(cached_icon(icon_path("alert-triangle.svg")))
             sip.transferto(error_item, self)
             return [error_item]
 
@@ -940,21 +966,48 @@ class MerginRootItem(QgsDataCollectionItem):
 
         return self.createChildrenProjects()
 
+    def reset_projects(self):
+        """
+        Clear fetched projects. If they are just being fetched, the fetched page is dropped and the item gets
+        refreshed once populating finishes (QGIS ignores refresh/depopulate of a populating item).
+        """
+        self.projects = []
+        self.projects_generation += 1
+        self.fetch_more_requested = False
+        if self.state() == QgsDataItem.Populating:
+            self.refresh_pending = True
+
+    def on_state_changed(self, item, old_state):
+        if self.refresh_pending and self.state() != QgsDataItem.Populating:
+            self.refresh_pending = False
+            self.refresh()
+
     def createChildrenProjects(self):
-        if not self.projects:
-            error = self.fetch_projects()
+        generation = self.projects_generation
+        if self.fetch_more_requested:
+            # fetching more projects - keep the already fetched ones listed even if the request fails
+            self.fetch_projects(page=len(self.projects) // PROJS_PER_PAGE + 1, generation=generation)
+            self.fetch_more_requested = False
+        if not self.projects and generation == self.projects_generation:
+            error = self.fetch_projects(generation=generation)
             if error is not None:
                 return error
+        if generation != self.projects_generation:
+            # projects were cleared while fetching, the item gets refreshed again once populating finishes
+            return []
         items = []
-        for project in self.projects:
-            project_name = posixpath.join(project["namespace"], project["name"])  # posix path for server API calls
-            local_proj_path = mergin_project_local_path(project_name)
-            if local_proj_path is None or not os.path.exists(local_proj_path):
+        # posix path for server API calls
+        project_names = [posixpath.join(project["namespace"], project["name"]) for project in self.projects]
+        local_paths = mergin_projects_local_paths(project_names)
+        transferto = sip.transferto  # avoid the attribute lookup for each project
+        for project, project_name in zip(self.projects, project_names):
+            local_proj_path = local_paths[project_name]
+            if local_proj_path is None:
                 item = MerginRemoteProjectItem(self, project, self.project_manager)
                 item.setState(QgsDataItem.Populated)  # make it non-expandable
             else:
-                item = MerginLocalProjectItem(self, project, self.project_manager)
-            sip.transferto(item, self)
+                item = MerginLocalProjectItem(self, project, self.project_manager, local_proj_path)
+            transferto(item, self)
             items.append(item)
         self.set_fetch_more_item()
         if self.fetch_more_item is not None:
@@ -982,8 +1035,13 @@ class MerginRootItem(QgsDataCollectionItem):
 
         return items
 
-    def fetch_projects(self, page=1, per_page=PROJS_PER_PAGE):
-        """Get paginated projects list from Mergin Maps service. If anything goes wrong, return an error item."""
+    def fetch_projects(self, page=1, per_page=PROJS_PER_PAGE, generation=None):
+        """
+        Get paginated projects list from Mergin Maps service. If anything goes wrong, return an error item.
+        The page is dropped if fetched projects were cleared since the given projects generation.
+        """
+        if generation is None:
+            generation = self.projects_generation
         if self.project_manager is None:
             error_item = QgsErrorItem(self, "Failed to log in. Please check the configuration", "/Mergin/error")
             sip.transferto(error_item, self)
@@ -1007,6 +1065,9 @@ class MerginRootItem(QgsDataCollectionItem):
                     per_page=per_page,
                     order_params="name_asc",
                 )
+            if generation != self.projects_generation:
+                # projects were cleared meanwhile (reload, config or workspace change), the page is outdated
+                return None
             self.projects += resp["projects"]
             self.total_projects_count = int(resp["count"]) if is_number(resp["count"]) else 0
         except URLError:
@@ -1041,15 +1102,17 @@ class MerginRootItem(QgsDataCollectionItem):
         if self.fetch_more_item is None:
             QMessageBox.information(None, "Fetch Mergin Maps Projects", "All projects already listed.")
             return
-        page_to_get = floor(self.rowCount() / PROJS_PER_PAGE) + 1
-        dummy = self.fetch_projects(page=page_to_get)
+        if self.fetch_more_requested or self.state() == QgsDataItem.Populating:
+            return  # the previous fetch has not finished yet
+        # the page is fetched when children are created - QGIS does that in a worker thread, not blocking the GUI
+        self.fetch_more_requested = True
         self.refresh()
 
     def reload(self):
         if not self.plugin.current_workspace:
             self.plugin.choose_active_workspace()
 
-        self.projects = []
+        self.reset_projects()
         self.refresh()
 
     def new_project(self):
@@ -1060,41 +1123,39 @@ class MerginRootItem(QgsDataCollectionItem):
         self.plugin.configure()
 
     def actions(self, parent):
-        action_configure = QAction(QIcon(icon_path("settings.svg")), "Configure", parent)
+        action_configure = QAction(cached_icon(icon_path("settings.svg")), "Configure", parent)
         action_configure.triggered.connect(self.plugin.configure)
 
-        action_refresh = QAction(QIcon(icon_path("repeat.svg")), "Refresh", parent)
-        action_refresh.triggered.connect(self.reload)
-
-        action_create = QAction(QIcon(icon_path("square-plus.svg")), "Create new project", parent)
+        actions = [action_configure]
+        if not self.mc:
+            return actions
+        # only construct actions available for the server type
+        server_type = self.mc.server_type()
+        if server_type not in (ServerType.OLD, ServerType.CE, ServerType.EE, ServerType.SAAS):
+            return actions
+
+        if server_type != ServerType.OLD:
+            action_refresh = QAction(cached_icon(icon_path("repeat.svg")), "Refresh", parent)
+            action_refresh.triggered.connect(self.reload)
+            actions.append(action_refresh)
+
+        action_create = QAction(cached_icon(icon_path("square-plus.svg")), "Create new project", parent)
         action_create.triggered.connect(self.new_project)
+        actions.append(action_create)
 
-        action_find = QAction(QIcon(icon_path("search.svg")), "Find project", parent)
-        action_find.triggered.connect(self.plugin.find_project)
+        if server_type != ServerType.OLD:
+            action_find = QAction(cached_icon(icon_path("search.svg")), "Find project", parent)
+            action_find.triggered.connect(self.plugin.find_project)
+            actions.append(action_find)
 
-        action_switch = QAction(QIcon(icon_path("replace.svg")), "Switch workspace", parent)
-        action_switch.triggered.connect(self.plugin.switch_workspace)
+        if server_type in (ServerType.EE, ServerType.SAAS):
+            action_switch = QAction(cached_icon(icon_path("replace.svg")), "Switch workspace", parent)
+            action_switch.triggered.connect(self.plugin.switch_workspace)
+            actions.append(action_switch)
 
-        action_explore = QAction(QIcon(icon_path("explore.svg")), "Explore public projects", parent)
+        action_explore = QAction(cached_icon(icon_path("explore.svg")), "Explore public projects", parent)
         action_explore.triggered.connect(self.plugin.explore_public_projects)
-
-        actions = [action_configure]
-        if self.mc:
-            server_type = self.mc.server_type()
-            if server_type == ServerType.OLD:
-                actions.append(action_create)
-                actions.append(action_explore)
-            elif server_type == ServerType.CE:
-                actions.append(action_refresh)
-                actions.append(action_create)
-                actions.append(action_find)
-                actions.append(action_explore)
-            elif server_type in (ServerType.EE, ServerType.SAAS):
-                actions.append(action_refresh)
-                actions.append(action_create)
-                actions.append(action_find)
-                actions.append(action_switch)
-                actions.append(action_explore)
+        actions.append(action_explore)
         return actions
 
 
@@ -1111,15 +1172,15 @@ class MerginGroupItem(MerginRootItem):
         return self.createChildrenProjects()
 
     def actions(self, parent):
-        action_refresh = QAction(QIcon(icon_path("repeat.svg")), "Reload", parent)
+        action_refresh = QAction(cached_icon(icon_path("repeat.svg")), "Reload", parent)
         action_refresh.triggered.connect(self.reload)
         actions = [action_refresh]
         if self.fetch_more_item is not None:
-            action_fetch_more = QAction(QIcon(icon_path("dots.svg")), "Fetch more", parent)
+            action_fetch_more = QAction(cached_icon(icon_path("dots.svg")), "Fetch more", parent)
             action_fetch_more.triggered.connect(self.fetch_more)
             actions.append(action_fetch_more)
         if self.name().startswith("My projects"):
-            action_create = QAction(QIcon(icon_path("square-plus.svg")), "Create new project", parent)
+            action_create = QAction(cached_icon(icon_path("square-plus.svg")), "Create new project", parent)
             action_create.triggered.connect(self.new_project)
             actions.append(action_create)
         return actions
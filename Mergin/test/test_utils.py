@@ -5,7 +5,7 @@ import json
 import copy
 import tempfile
 
-from qgis.PyQt.QtCore import QVariant
+from qgis.PyQt.QtCore import QSettings, QVariant
 from qgis.core import (
     QgsProject,
     QgsDatumTransform,
@@ -16,7 +16,14 @@ from qgis.core import (
 )
 
 from qgis.testing import start_app, unittest
-from Mergin.utils import same_schema, get_datum_shift_grids, is_valid_name, create_tracking_layer
+from Mergin.utils import (
+    same_schema,
+    get_datum_shift_grids,
+    is_valid_name,
+    create_tracking_layer,
+    find_qgis_files,
+    mergin_projects_local_paths,
+)
 
 test_data_path = os.path.join(os.path.dirname(__file__), "data")
 
@@ -197,6 +204,56 @@ class test_utils(unittest.TestCase):
             self.assertEqual(fields[4].name(), "tracked_by")
             self.assertEqual(fields[4].type(), QVariant.String)
 
+    def test_find_qgis_files(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, ".mergin"))
+            os.makedirs(os.path.join(temp_dir, "subdir"))
+            file_paths = [
+                os.path.join(temp_dir, ".mergin", "x.qgs"),
+                os.path.join(temp_dir, "project.qgs"),
+                os.path.join(temp_dir, "subdir", "other.qgz"),
+                os.path.join(temp_dir, "subdir", "data.gpkg"),
+            ]
+            for file_path in file_paths:
+                open(file_path, "w").close()
+
+            qgis_files = find_qgis_files(temp_dir)
+            self.assertEqual(
+                sorted(qgis_files),
+                sorted([os.path.join(temp_dir, "project.qgs"), os.path.join(temp_dir, "subdir", "other.qgz")]),
+            )
+
+    def test_mergin_projects_local_paths(self):
+        settings = QSettings()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            valid_dir = os.path.join(temp_dir, "valid")
+            os.makedirs(os.path.join(valid_dir, ".mergin"))
+            no_mergin_dir = os.path.join(temp_dir, "no_mergin")
+            os.makedirs(no_mergin_dir)
+            missing_dir = os.path.join(temp_dir, "missing")
+
+            settings.setValue("Mergin/localProjects/test_ns/valid/path", valid_dir)
+            settings.setValue("Mergin/localProjects/test_ns/no_mergin/path", no_mergin_dir)
+            settings.setValue("Mergin/localProjects/test_ns/missing/path", missing_dir)
+            try:
+                project_names = ["test_ns/valid", "test_ns/no_mergin", "test_ns/missing", "test_ns/not_stored"]
+                local_paths = mergin_projects_local_paths(project_names)
+                self.assertEqual(
+                    local_paths,
+                    {
+                        "test_ns/valid": valid_dir,
+                        "test_ns/no_mergin": None,
+                        "test_ns/missing": None,
+                        "test_ns/not_stored": None,
+                    },
+                )
+                # invalid entries are removed from settings, the valid one is kept
+                self.assertEqual(settings.value("Mergin/localProjects/test_ns/valid/path"), valid_dir)
+                self.assertIsNone(settings.value("Mergin/localProjects/test_ns/no_mergin/path"))
+                self.assertIsNone(settings.value("Mergin/localProjects/test_ns/missing/path"))
+            finally:
+                settings.remove("Mergin/localProjects/test_ns")
+
 
 if __name__ == "__main__":
     nose2.main()
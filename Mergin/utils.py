@@ -1,4 +1,5 @@
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from enum import Enum
 from urllib.error import URLError, HTTPError
@@ -42,6 +43,7 @@ from qgis.core import (
     QgsVectorLayer,
     QgsProviderRegistry,
     QgsSettings,
+    QgsTask,
     QgsDatumTransform,
     QgsProjUtils,
     QgsDataSourceUri,
@@ -135,8 +137,18 @@ PACKABLE_PROVIDERS = ("ogr", "gdal", "delimitedtext", "gpx", "postgres", "memory
 
 PROJS_PER_PAGE = 50
 
+# number of threads used to check local projects directories
+LOCAL_PATHS_CHECK_WORKERS = 16
+
 TILES_URL = "https://tiles.merginmaps.com"
 
+PLUGIN_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# tabler icons directories for each icon set
+TABLER_ICONS_DIRS = {
+    icon_set: os.path.join(PLUGIN_DIR, "images", icon_set, "tabler_icons") for icon_set in ("default", "white")
+}
+
 
 class PackagingError(Exception):
     pass
@@ -200,9 +212,11 @@ class FieldConverter(QgsVectorFileWriter.FieldValueConverter):
 def find_qgis_files(directory):
     qgis_files = []
     for root, dirs, files in os.walk(directory):
+        # do not descend into Mergin Maps metadata dir - there are no QGIS projects, only copies of data files
+        if ".mergin" in dirs:
+            dirs.remove(".mergin")
         for f in files:
-            _, ext = os.path.splitext(f)
-            if ext in [".qgs", ".qgz"]:
+            if f.endswith((".qgs", ".qgz")):
                 qgis_files.append(os.path.join(root, f))
     return qgis_files
 
@@ -1008,6 +1022,11 @@ def set_qgis_project_mergin_variables():
     return None
 
 
+def is_local_mergin_project_dir(path):
+    """Check if the directory exists and contains Mergin Maps project subdir (.mergin)."""
+    return os.path.exists(path) and bool(check_mergin_subdirs(path))
+
+
 def mergin_project_local_path(project_name=None):
     """
     Try to get local Mergin Maps project path. If project_name is specified, look for this specific project, otherwise
@@ -1019,7 +1038,7 @@ def mergin_project_local_path(project_name=None):
         proj_path = settings.value(f"Mergin/localProjects/{project_name}/path", None)
         # check local project dir was not unintentionally removed, or .mergin dir was removed
         if proj_path:
-            if not os.path.exists(proj_path) or not check_mergin_subdirs(proj_path):
+            if not is_local_mergin_project_dir(proj_path):
                 # project dir does not exist or is not a Mergin project anymore, let's remove it from settings
                 settings.remove(f"Mergin/localProjects/{project_name}/path")
                 proj_path = None
@@ -1036,9 +1055,76 @@ def mergin_project_local_path(project_name=None):
     return None
 
 
+def mergin_projects_local_paths(project_names):
+    """
+    Get local paths of the given Mergin Maps projects, reading local projects info from QSettings only once.
+    :param project_names: list of full project names (namespace/name)
+    :return: dict mapping each project name to its local path if project was already downloaded, None otherwise.
+    """
+    settings = QSettings()
+    stored_paths = dict()
+    settings.beginGroup("Mergin/localProjects/")
+    for key in settings.allKeys():
+        # Expecting key in the following form: '<namespace>/<project_name>/path'
+        key_parts = key.split("/")
+        if len(key_parts) > 2 and key_parts[2] == "path":
+            stored_paths[f"{key_parts[0]}/{key_parts[1]}"] = settings.value(key, None)
+    settings.endGroup()
+
+    candidates = {name: stored_paths[name] for name in project_names if stored_paths.get(name)}
+    # check local project dirs were not unintentionally removed, or .mergin dir was removed. Each check stats
+    # the file system, which can be slow e.g. on network drives, so run the checks concurrently
+    if len(candidates) > 1:
+        with ThreadPoolExecutor(max_workers=LOCAL_PATHS_CHECK_WORKERS) as executor:
+            valid = list(executor.map(is_local_mergin_project_dir, candidates.values()))
+    else:
+        valid = [is_local_mergin_project_dir(path) for path in candidates.values()]
+
+    local_paths = dict.fromkeys(project_names)
+    for (project_name, proj_path), is_valid in zip(candidates.items(), valid):
+        if is_valid:
+            local_paths[project_name] = proj_path
+        else:
+            # project dir does not exist or is not a Mergin project anymore, let's remove it from settings
+            settings.remove(f"Mergin/localProjects/{project_name}/path")
+    return local_paths
+
+
+def remove_local_project_dir(path, project_name):
+    """
+    Remove local Mergin Maps project directory in a QGIS background task, so GUI does not freeze on large projects.
+    Errors are reported to the user once the task finishes. Setting "Mergin/syncRemove" to true makes the removal
+    blocking instead.
+    """
+
+    def on_finished(exception, result=None):
+        if exception is None:
+            return
+        QgsApplication.messageLog().logMessage(f"Mergin Maps plugin: {str(exception)}")
+        msg = (
+            f"Failed to delete your project {project_name}.\n"
+            "You might need to close project or QGIS to remove its files."
+        )
+        QMessageBox.critical(None, "Project delete", msg, QMessageBox.Close)
+
+    settings = QSettings()
+    if settings.value("Mergin/syncRemove", False, type=bool):
+        try:
+            shutil.rmtree(path)
+        except OSError as e:
+            on_finished(e)
+        return
+
+    # shutil.rmtree already removes entries relative to open directory descriptors where the platform supports it
+    task = QgsTask.fromFunction(
+        f"Removing local project {project_name}", lambda task: shutil.rmtree(path), on_finished=on_finished
+    )
+    QgsApplication.taskManager().addTask(task)
+
+
 def icon_path(icon_filename):
     icon_set = "white" if is_dark_theme() else "default"
-    ipath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "images", icon_set, "tabler_icons", icon_filename)
+    ipath = os.path.join(TABLER_ICONS_DIRS[icon_set], icon_filename)
     return ipath
 
 
@@ -1050,7 +1136,7 @@ def mm_logo_path():
         icon_set = "default"
         icon_filename = "MM_logo_HORIZ_COLOR_VECTOR.svg"
 
-    ipath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "images", icon_set, icon_filename)
+    ipath = os.path.join(PLUGIN_DIR, "images", icon_set, icon_filename)
     return ipath
 
 
@@ -1063,7 +1149,7 @@ def mm_symbol_path():
         icon_color = "COLOR"
 
     icon_filename = "MM_symbol_" + icon_color + "_no_padding.svg"
-    ipath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "images", icon_set, icon_filename)
+    ipath = os.path.join(PLUGIN_DIR, "images", icon_set, icon_filename)
     return ipath
 
 